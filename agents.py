@@ -1,20 +1,106 @@
 import math
+import os
 import random
 import typing
-from copy import deepcopy
-from typing import Generic, List, Optional, TypeVar, Literal
+from collections import Counter
+from functools import lru_cache
+from multiprocessing import Pool
+from typing import Dict, List, Literal
 
+import numpy as np
+
+import board
+from board import BITS, check_status, njit
+from solver import OPTIMAL_MOVE
 from gym_tictactoe.env import (
-    TicTacToeEnv,
     after_action_state,
     agent_by_mark,
     check_game_status,
     next_mark,
     tocode,
-    tomark,
 )
 
-NODE_ID_COUNTER = 0
+
+@lru_cache(maxsize=None)
+def _load_mcts_core():
+    """
+    Import C search loop (mcts_core.pyx), compiling it on first use.
+    Needs Cython & a C compiler, otherwise returns None and
+    TicTacPro falls back to the Python/numba implementation.
+    """
+    try:
+        import pyximport
+
+        pyximport.install()
+        import mcts_core
+    except ImportError:
+        return None
+    return mcts_core
+
+
+# Cheaper than random.choice, which validates its argument
+rand = random.random
+
+# Pure function of a tiny state space, so cache saturates quickly
+_check_status = lru_cache(maxsize=None)(check_status)
+
+
+def _build_terminal_table():
+    """
+    Enumerate every reachable board (with either mark starting),
+    and record game status after each (state, action) pair,
+    keyed by packed state (see board.encode) and action.
+    Non-moving mark is included too, so agents can look up
+    what their opponent could do.
+    """
+    table = {}
+    seen = set()
+    frontier = [(0,) * 9]
+    while frontier:
+        cells = frontier.pop()
+        if cells in seen:
+            continue
+        seen.add(cells)
+        n_o, n_x = cells.count(tocode("O")), cells.count(tocode("X"))
+        for mark in ("O", "X"):
+            playable = n_x <= n_o if mark == "X" else n_o <= n_x
+            code = board.encode((cells, mark)) << 4
+            for action in [i for i, c in enumerate(cells) if c == 0]:
+                ncells, _ = after_action_state((cells, mark), action)
+                gstatus = check_game_status(ncells)
+                table[code | action] = gstatus
+                if playable and gstatus == -1:
+                    frontier.append(ncells)
+    return table
+
+
+# packed state << 4 | action -> game status after action
+TERMINAL_TABLE = _build_terminal_table()
+
+
+def _build_first_moves():
+    """
+    Best move for each board of ply 0 or 1, from tic-tac-toe theory
+    (all draw-securing): open in the center, answer a center
+    opening with a corner and any other opening with the center.
+    """
+    book = {0: 4}
+    for cell in range(9):
+        reply = 0 if cell == 4 else 4
+        book[BITS[cell] << 9] = reply  # X opened
+        book[BITS[cell]] = reply  # O opened
+    return book
+
+
+# packed board, without mark to move -> action.
+# Skips searching the first move of each side
+FIRST_MOVES = _build_first_moves()
+
+
+def available_actions(state):
+    """Return free cells of given state"""
+    return [i for i, c in enumerate(state[0]) if c == 0]
+
 
 Mark = Literal["X", "O"]
 
@@ -34,15 +120,22 @@ class BaseAgent:
     def opponent_mark(self):
         return next_mark(self.mark)
 
-    def act(self, state, my_env):
-        available_actions = my_env.available_actions()
-        for action in available_actions:
-            nstate = after_action_state(my_env.state, action)
-            gstatus = check_game_status(nstate[0])
-            if gstatus > 0:
-                if tomark(gstatus) == self.mark:
-                    return action
-        return random.choice(available_actions)
+    def reset(self):
+        """Clear any per-game state before a new game"""
+        pass
+
+    def close(self):
+        """Release any resources held by the agent"""
+        pass
+
+    def act(self, state):
+        actions = available_actions(state)
+        code = board.encode(state) << 4
+        win = tocode(self.mark)
+        for action in actions:
+            if TERMINAL_TABLE.get(code | action, -1) == win:
+                return action
+        return actions[int(rand() * len(actions))]
 
 
 class TicTacJoe(BaseAgent):
@@ -55,83 +148,156 @@ class TicTacJoe(BaseAgent):
 
     name = "TicTacJoe"
 
-    def act(self, state, my_env: TicTacToeEnv):
-        available_actions = my_env.available_actions()
+    def act(self, state):
+        actions = available_actions(state)
         # --- Step 1: play winning move, if possible ---
-        for action in available_actions:
-            nstate = after_action_state(state, action)
-            gstatus = check_game_status(nstate[0])
-            if gstatus > 0:
-                if tomark(gstatus) == self.mark:
-                    return action
+        code = board.encode(state) << 4
+        win = tocode(self.mark)
+        for action in actions:
+            if TERMINAL_TABLE.get(code | action, -1) == win:
+                return action
 
         # --- Step 2: block opponent from winning ---
         # imagine the opponent was playing
-        rev_state = (state[0], next_mark(state[1]))
-        for action in available_actions:
-            nstate = after_action_state(rev_state, action)
-            gstatus = check_game_status(nstate[0])
-            if gstatus > 0:
-                # if they can make a winning move, play that
-                if tomark(gstatus) == self.opponent_mark:
-                    return action
+        rev_code = code ^ (board.X_TO_MOVE << 4)
+        lose = tocode(self.opponent_mark)
+        for action in actions:
+            # if they can make a winning move, play that
+            if TERMINAL_TABLE.get(rev_code | action, -1) == lose:
+                return action
 
-        return random.choice(available_actions)
+        return actions[int(rand() * len(actions))]
 
 
 # =============== TicTacPro ===============
 
 
-T = TypeVar("T")
-
-
-class Node(Generic[T]):
-    """A basic node for building search tree"""
-
-    def __init__(self, state, action, parent: Optional["Node[T]"] = None):
-        global NODE_ID_COUNTER
-
-        self.id = NODE_ID_COUNTER
-        NODE_ID_COUNTER += 1
-
-        self.state = state
-        self.action = action
-
-        self.visits = 0  # n
-        self.value = 0  # q
-
-        self.parent = parent
-        self.children: List["Node[T]"] = []
-
-        if parent:
-            self.update_parent_callback()
+class Tree:
+    """
+    Search tree stored as flat arrays (struct of arrays), indexed by node.
+    Node 0 is the root. Children of a node are contiguous, at
+    first_child[node] up to first_child[node] + n_children[node].
+    """
 
-    @property
-    def unvisited(self):
-        return self.visits == 0
+    def __init__(self, root_state, max_nodes: int):
+        self.visits = np.zeros(max_nodes, np.int32)  # n
+        self.value = np.zeros(max_nodes, np.float64)  # q
+        self.action = np.full(max_nodes, -1, np.int8)
+        self.parent = np.full(max_nodes, -1, np.int32)
+        self.first_child = np.zeros(max_nodes, np.int32)
+        self.n_children = np.zeros(max_nodes, np.int8)
+        # children before this one have all been visited
+        self.next_unvisited = np.zeros(max_nodes, np.int32)
+        self.x_mask = np.zeros(max_nodes, np.int16)
+        self.o_mask = np.zeros(max_nodes, np.int16)
+        self.x_to_move = np.zeros(max_nodes, np.bool_)
+
+        x_mask, o_mask, mark = root_state
+        self.x_mask[0] = x_mask
+        self.o_mask[0] = o_mask
+        self.x_to_move[0] = mark == "X"
+        self.n_nodes = 1
+
+    def state(self, node: int):
+        """Return (x_mask, o_mask, x_to_move) of given node"""
+        return (
+            int(self.x_mask[node]),
+            int(self.o_mask[node]),
+            bool(self.x_to_move[node]),
+        )
 
-    def update_parent_callback(self):
-        """Create two-way link"""
-        self.parent.children.append(self)
+    def children(self, node: int) -> range:
+        start = int(self.first_child[node])
+        return range(start, start + int(self.n_children[node]))
+
+    def add_children(self, node: int, actions: List[int]) -> range:
+        """Append a child for each action, return their indices"""
+        x_mask, o_mask, x_to_move = self.state(node)
+        start = self.n_nodes
+        for child, action in enumerate(actions, start):
+            if x_to_move:
+                self.x_mask[child] = x_mask | BITS[action]
+                self.o_mask[child] = o_mask
+            else:
+                self.x_mask[child] = x_mask
+                self.o_mask[child] = o_mask | BITS[action]
+            self.x_to_move[child] = not x_to_move
+            self.action[child] = action
+            self.parent[child] = node
+        self.first_child[node] = start
+        self.next_unvisited[node] = start
+        self.n_children[node] = len(actions)
+        self.n_nodes += len(actions)
+        return range(start, self.n_nodes)
+
+    def backpropogate_score(self, node: int, inc_visits, inc_value):
+        _backpropogate(
+            self.parent, self.visits, self.value, node, inc_visits, inc_value
+        )
 
-    def backpropogate_score(self, inc_visits, inc_value):
-        self.visits += inc_visits
-        self.value += inc_value
-        if self.parent:
-            self.parent.backpropogate_score(inc_visits, inc_value)
 
-    def __repr__(self):
-        return f"{self.id}: {self.value}/{self.visits}"
+# log of visit counts, covers n_iter * n_rollouts with the defaults
+LOG = np.log(np.arange(100_001, dtype=np.float64).clip(1))
+sqrt = math.sqrt
+
+
+@njit(cache=True)
+def _select(first_child, n_children, next_unvisited, visits, value, c, log_table):
+    """Walk down from root, return selected node (see TicTacPro.select)"""
+    node = 0
+    while n_children[node]:
+        start = first_child[node]
+        stop = start + n_children[node]
+        # if any unexplored children, pick one.
+        # visits never drop back to 0, so cursor only moves forward
+        best = next_unvisited[node]
+        while best < stop and visits[best]:
+            best += 1
+        next_unvisited[node] = best
+        # otherwise, choose best child according to ucb
+        if best == stop:
+            parent_visits = visits[node]
+            if parent_visits < log_table.size:
+                log_parent = log_table[parent_visits]
+            else:
+                log_parent = math.log(parent_visits)
+            best_score = -math.inf
+            for child in range(start, stop):
+                score = value[child] / visits[child] + c * sqrt(
+                    log_parent / visits[child]
+                )
+                if score > best_score:
+                    best, best_score = child, score
+        node = best
+    return node
+
+
+@njit(cache=True)
+def _backpropogate(parent, visits, value, node, inc_visits, inc_value):
+    while node != -1:
+        visits[node] += inc_visits
+        value[node] += inc_value
+        node = parent[node]
 
 
 class TicTacPro(BaseAgent):
     """
-    Monte Carlo Tree Search Based
+    Monte Carlo Tree Search Based.
+    By default plays from the exact solution (see solver.py) instead,
+    since tic-tac-toe is small enough to solve outright.
     """
 
     name = "TicTacPro"
 
-    def __init__(self, mark: Mark, n_iter=10000, c=50):
+    def __init__(
+        self,
+        mark: Mark,
+        n_iter=10000,
+        c=50,
+        n_workers=None,
+        n_rollouts=8,
+        use_solver=True,
+    ):
         """
         Parameters
         ----------
@@ -141,106 +307,175 @@ class TicTacPro(BaseAgent):
                 process to carry out before making a move.
         c: int
                 Confidence constant used in UCT formula.
+        n_workers: int
+                Number of processes to split iterations across.
+                Each builds an independent tree and root visit
+                counts are summed (root parallelization).
+                Defaults to the number of CPUs; 1 searches in-process.
+        n_rollouts: int
+                Number of random playouts simulated from each
+                expanded leaf (leaf parallelization).
+        use_solver: bool
+                If true, look moves up in the solved table.
+                If false, pick them by Monte Carlo tree search.
         """
         self.mark = mark
         self.n_iter = n_iter
         self.c = c
+        self.n_rollouts = n_rollouts
+        self.use_solver = use_solver
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.pool = None
+        if self.n_workers > 1 and not use_solver:
+            self.pool = Pool(self.n_workers)
+
+    def close(self):
+        """Shut down worker pool"""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def act(self, starting_state):
+        """
+        Given a current board state, look up optimal move, or
+        build up tree(s) then select most visited move.
+        """
+        code = board.encode(starting_state)
+        if self.use_solver:
+            return OPTIMAL_MOVE[code]
+
+        if code & board.BOARD in FIRST_MOVES:
+            return FIRST_MOVES[code & board.BOARD]
+
+        if self.pool is None:
+            visits = self.search(starting_state)
+        else:
+            k = self.n_workers
+            jobs = [
+                (
+                    starting_state,
+                    self.n_iter // k + (i < self.n_iter % k),
+                    self.c,
+                    self.n_rollouts,
+                    self.mark,
+                    random.getrandbits(32),
+                )
+                for i in range(k)
+            ]
+            visits = Counter()
+            for worker_visits in self.pool.starmap(_mcts_worker, jobs):
+                visits.update(worker_visits)
 
-    def act(self, starting_state, env: TicTacToeEnv):
+        # As action, select child with highest number of visits
+        return max(visits, key=visits.get)
+
+    def search(self, starting_state) -> Dict[int, int]:
         """
-        Given a current board state & TicTacToe environment,
-        build up tree then select best seen move.
+        Build up a tree from given board state,
+        return number of visits for each action at the root.
+
+        The tree is walked purely through bitboard
+        transitions (see board.py). If available, the whole
+        loop runs in C (see mcts_core.pyx).
         """
 
-        global NODE_ID_COUNTER
-        NODE_ID_COUNTER = 0
+        root_state = board.from_state(starting_state)
+        mcts_core = _load_mcts_core()
+        if mcts_core is not None:
+            x_mask, o_mask, mark = root_state
+            return mcts_core.search(
+                x_mask,
+                o_mask,
+                mark == "X",
+                self.mark == "X",
+                self.n_iter,
+                self.c,
+                self.n_rollouts,
+                random.getrandbits(32),
+            )
 
-        root_node: Node = Node(starting_state, action=None, parent=None)
+        # each iteration expands at most one node, into at most 9 children
+        tree = Tree(root_state, max_nodes=1 + 9 * self.n_iter)
 
         for _ in range(self.n_iter):
-            my_env = deepcopy(env)
             # --- selection ---
-            node, my_env = self.select(root_node, my_env)
+            node = self.select(tree)
             # --- expansion ---
-            node, my_env = self.expand(node, my_env)
+            node = self.expand(tree, node)
             # --- simulation ----
-            reward = self.simulate(node, my_env)
+            reward = self.simulate(tree, node)
             # --- backpropogation ---
-            node.backpropogate_score(inc_visits=1, inc_value=reward)
+            tree.backpropogate_score(node, inc_visits=self.n_rollouts, inc_value=reward)
 
-        # As action, select child with highest number of visits
-        best_child = max(root_node.children, key=lambda x: x.visits)
-
-        return best_child.action
+        return {
+            int(tree.action[child]): int(tree.visits[child])
+            for child in tree.children(0)
+        }
 
-    def select(self, node: Node, my_env: TicTacToeEnv):
+    def select(self, tree: Tree) -> int:
         """
-        MCTS: Selection stage.
+        MCTS: Selection stage, starting from root.
             - If node has any unvisted children, select one
-            - If all children visited, choose best by UCB score
-              and advance environment
+            - If all children visited, choose best by UCB score,
+              using self.c as confidence constant
             - If no children, return itself.
         """
-        while node.children:
-            # if any unexplored children, pick one
-            univisted_children = [c for c in node.children if c.unvisited]
-            if univisted_children:
-                node = univisted_children[0]
-            # otherwise, choose best child according to ucb
-            else:
-                node = max(node.children, key=self.ucb_score)
-            # step copied environment forward
-            my_env.step(node.action)
-        return node, my_env
+        return int(
+            _select(
+                tree.first_child,
+                tree.n_children,
+                tree.next_unvisited,
+                tree.visits,
+                tree.value,
+                self.c,
+                LOG,
+            )
+        )
 
-    def expand(self, node: Node, my_env: TicTacToeEnv):
+    def expand(self, tree: Tree, node: int) -> int:
         """
         MCTS: Expansion stage.
           - If additional moves are possible from given node
-            child nodes will be created, one selected, and env advanced.
-          - If not, same node and env will be returned.
+            child nodes will be created and one selected.
+            A move winning on the spot is the only child created.
+          - If not, same node will be returned.
         """
         # If this is a terminal state, don't try to expand
-        if my_env.done:
-            return node, my_env
+        x_mask, o_mask, x_to_move = tree.state(node)
+        if _check_status(x_mask, o_mask) != -1:
+            return node
+
+        # If a move wins outright, assume it is played:
+        # siblings are never worth exploring
+        action = board.winning_action(x_mask, o_mask, x_to_move)
+        if action != -1:
+            actions = [action]
+        else:
+            actions = board.available_actions(x_mask, o_mask)
 
         # Add a child node for each possible action
-        for action in my_env.available_actions():
-            nstate = after_action_state(node.state, action)
-            Node(nstate, action, parent=node)
+        children = tree.add_children(node, actions)
 
         # If node has children after expansion, select one
-        if node.children:
-            node = random.choice(node.children)
-            my_env.step(node.action)
+        if children:
+            node = children[int(rand() * len(children))]
 
-        return node, my_env
+        return node
 
-    def simulate(self, node: Node, my_env: TicTacToeEnv) -> float:
+    def simulate(self, tree: Tree, node: int) -> float:
         """
         MCTS: Simulation stage.
-            - Randomly play out remainder of moved and report reward
+            - Randomly play out remainder of moved, self.n_rollouts
+              times, and report total reward
 
         Won reward=1, Tie reward=0.5, Lost reward=0
         """
-        state = node.state
-        while not my_env.done:
-            action = random.choice(my_env.available_actions())
-            state, _, _, _ = my_env.step(action)
-        return self.compute_reward(state)
-
-    def ucb_score(self, node: Node):
-        """Given a node, return UCB score. Uses self.c as confidence constant."""
-        if not node.parent:
-            raise RuntimeError("UCB score called for node with no parent.")
-
-        return (node.value / node.visits) + self.c * math.sqrt(
-            (math.log(node.parent.visits)) / node.visits
-        )
+        counts = board.batch_rollout(*tree.state(node), self.n_rollouts)
+        return sum(n * self.compute_reward(gstatus) for gstatus, n in enumerate(counts))
 
-    def compute_reward(self, state):
-        """Given a terminal state, return reward"""
-        gstatus = check_game_status(state[0])
+    def compute_reward(self, gstatus):
+        """Given a terminal game status, return reward"""
         if gstatus == -1:
             raise RuntimeError(
                 "Error! Compute reward called when game was not finished."
@@ -254,3 +489,17 @@ class TicTacPro(BaseAgent):
         # lost
         else:
             return 0
+
+
+def _mcts_worker(starting_state, n_iter, c, n_rollouts, mark, seed) -> Dict[int, int]:
+    """Run one independent search in a worker process"""
+    board.seed(seed)
+    agent = TicTacPro(
+        mark,
+        n_iter=n_iter,
+        c=c,
+        n_workers=1,
+        n_rollouts=n_rollouts,
+        use_solver=False,
+    )
+    return agent.search(starting_state)
@@ -0,0 +1,176 @@
+"""
+Bitboard representation of a tic-tac-toe board.
+
+A board is stored as two 9-bit integers (x_mask, o_mask),
+where bit i is set if that player has marked cell i.
+Cells are numbered like the gym_tictactoe board:
+
+    0 | 1 | 2
+    3 | 4 | 5
+    6 | 7 | 8
+"""
+
+import random
+
+import numpy as np
+from gym_tictactoe.env import tocode
+
+try:
+    from numba import njit
+except ImportError:
+
+    def njit(*args, **kwargs):
+        """numba not installed, leave kernels as plain Python"""
+        return lambda func: func
+
+
+# rows, columns, diagonals
+WIN_LINES = (0o007, 0o070, 0o700, 0o111, 0o222, 0o444, 0o421, 0o124)
+BITS = [1 << i for i in range(9)]
+FULL = 0o777
+
+X_WIN = tocode("X")
+O_WIN = tocode("O")
+
+# Packed int encoding of a state: bit 18 is set if X is to move,
+# bits 9-17 hold x_mask, bits 0-8 hold o_mask. Ints hash as themselves,
+# so packed states make cheap dict keys.
+X_TO_MOVE = 1 << 18
+BOARD = X_TO_MOVE - 1
+
+
+def from_state(state):
+    """Convert a gym (board, mark) state into (x_mask, o_mask, mark)"""
+    board, mark = state
+    x_mask = o_mask = 0
+    for i, c in enumerate(board):
+        if c == X_WIN:
+            x_mask |= BITS[i]
+        elif c == O_WIN:
+            o_mask |= BITS[i]
+    return x_mask, o_mask, mark
+
+
+def to_state(bstate):
+    """Convert (x_mask, o_mask, mark) back into a gym (board, mark) state"""
+    x_mask, o_mask, mark = bstate
+    board = tuple(
+        X_WIN if x_mask & bit else O_WIN if o_mask & bit else 0 for bit in BITS
+    )
+    return board, mark
+
+
+def pack(bstate):
+    """Pack (x_mask, o_mask, mark) into an int"""
+    x_mask, o_mask, mark = bstate
+    return (X_TO_MOVE if mark == "X" else 0) | x_mask << 9 | o_mask
+
+
+def unpack(code):
+    """Unpack an int into (x_mask, o_mask, mark)"""
+    return (code >> 9) & FULL, code & FULL, "X" if code & X_TO_MOVE else "O"
+
+
+def encode(state):
+    """Pack a gym (board, mark) state into an int"""
+    return pack(from_state(state))
+
+
+def decode(code):
+    """Unpack an int into a gym (board, mark) state"""
+    return to_state(unpack(code))
+
+
+def available_actions(x_mask, o_mask):
+    """Return list of free cells"""
+    occ = x_mask | o_mask
+    return [i for i in range(9) if not occ & BITS[i]]
+
+
+def after_action(bstate, action):
+    """Return bitboard state after current mark plays given action"""
+    x_mask, o_mask, mark = bstate
+    if mark == "X":
+        return x_mask | BITS[action], o_mask, "O"
+    return x_mask, o_mask | BITS[action], "X"
+
+
+def check_status(x_mask, o_mask):
+    """
+    Return game status, with the same codes as gym_tictactoe:
+    -1 in progress, 0 tie, otherwise code of the winning mark.
+    """
+    for line in WIN_LINES:
+        if x_mask & line == line:
+            return X_WIN
+        if o_mask & line == line:
+            return O_WIN
+    if x_mask | o_mask == FULL:
+        return 0
+    return -1
+
+
+def winning_action(x_mask, o_mask, x_to_move):
+    """Return a free cell completing a line for the player to move, or -1"""
+    mine = x_mask if x_to_move else o_mask
+    free = ~(x_mask | o_mask) & FULL
+    for line in WIN_LINES:
+        gap = line & ~mine
+        # exactly one cell of line missing, and it's free
+        if gap & free and not gap & (gap - 1):
+            return gap.bit_length() - 1
+    return -1
+
+
+@njit(cache=True)
+def rollout(x_mask, o_mask, x_to_move):
+    """
+    Randomly play out game from given board,
+    return final game status (see check_status).
+    """
+    while True:
+        for line in WIN_LINES:
+            if x_mask & line == line:
+                return X_WIN
+            if o_mask & line == line:
+                return O_WIN
+        free = ~(x_mask | o_mask) & FULL
+        if free == 0:
+            return 0
+        # pick k-th free cell: count bits, then clear lowest k
+        n_free = 0
+        bits = free
+        while bits:
+            bits &= bits - 1
+            n_free += 1
+        for _ in range(int(random.random() * n_free)):
+            free &= free - 1
+        bit = free & -free
+        if x_to_move:
+            x_mask |= bit
+        else:
+            o_mask |= bit
+        x_to_move = not x_to_move
+
+
+@njit(cache=True)
+def batch_rollout(x_mask, o_mask, x_to_move, k):
+    """
+    Play out k random games from given board, return
+    array counting results by game status (tie, O won, X won).
+    """
+    counts = np.zeros(3, np.int64)
+    for _ in range(k):
+        counts[rollout(x_mask, o_mask, x_to_move)] += 1
+    return counts
+
+
+@njit(cache=True)
+def _seed_kernels(seed):
+    random.seed(seed)
+
+
+def seed(seed):
+    """Seed random state used by rollouts (numba keeps its own)"""
+    random.seed(seed)
+    _seed_kernels(seed)
@@ -0,0 +1,215 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+"""
+C implementation of TicTacPro's search loop.
+
+Mirrors agents.TicTacPro.search: same flat tree layout as agents.Tree,
+same selection / expansion / simulation / backpropogation rules,
+with bitboards as in board.py. Built on first use via pyximport.
+"""
+
+from libc.math cimport INFINITY, log, sqrt
+from libc.stdlib cimport calloc, free
+
+# rows, columns, diagonals (see board.WIN_LINES)
+cdef int[8] WIN_LINES = [0o007, 0o070, 0o700, 0o111, 0o222, 0o444, 0o421, 0o124]
+cdef int FULL = 0o777
+cdef int X_WIN = 2
+cdef int O_WIN = 1
+
+
+cdef inline double uniform(unsigned long long *rng) nogil:
+    """xorshift64* step, returns a double in [0, 1)"""
+    cdef unsigned long long x = rng[0]
+    x ^= x >> 12
+    x ^= x << 25
+    x ^= x >> 27
+    rng[0] = x
+    return ((x * 2685821657736338717ULL) >> 11) * (1.0 / 9007199254740992.0)
+
+
+cdef int check_status(int x_mask, int o_mask) nogil:
+    cdef int i, line
+    for i in range(8):
+        line = WIN_LINES[i]
+        if x_mask & line == line:
+            return X_WIN
+        if o_mask & line == line:
+            return O_WIN
+    if x_mask | o_mask == FULL:
+        return 0
+    return -1
+
+
+cdef inline int lowest_bit_index(int bits) nogil:
+    cdef int i = 0
+    while not bits & 1:
+        bits >>= 1
+        i += 1
+    return i
+
+
+cdef int winning_action(int x_mask, int o_mask, bint x_to_move) nogil:
+    cdef int i, gap
+    cdef int mine = x_mask if x_to_move else o_mask
+    cdef int free_cells = ~(x_mask | o_mask) & FULL
+    for i in range(8):
+        gap = WIN_LINES[i] & ~mine
+        # exactly one cell of line missing, and it's free
+        if gap & free_cells and not gap & (gap - 1):
+            return lowest_bit_index(gap)
+    return -1
+
+
+cdef int rollout(
+    int x_mask, int o_mask, bint x_to_move, unsigned long long *rng
+) nogil:
+    cdef int status, free_cells, bits, n_free, k, bit
+    while True:
+        status = check_status(x_mask, o_mask)
+        if status != -1:
+            return status
+        free_cells = ~(x_mask | o_mask) & FULL
+        n_free = 0
+        bits = free_cells
+        while bits:
+            bits &= bits - 1
+            n_free += 1
+        k = <int>(uniform(rng) * n_free)
+        while k:
+            free_cells &= free_cells - 1
+            k -= 1
+        bit = free_cells & -free_cells
+        if x_to_move:
+            x_mask |= bit
+        else:
+            o_mask |= bit
+        x_to_move = not x_to_move
+
+
+def search(
+    int x_mask,
+    int o_mask,
+    bint x_to_move,
+    bint agent_is_x,
+    int n_iter,
+    double c,
+    int n_rollouts,
+    unsigned int seed,
+):
+    """
+    Build up a tree from given bitboard,
+    return number of visits for each action at the root.
+    """
+    cdef int max_nodes = 1 + 9 * n_iter
+    cdef int *visits = <int *>calloc(max_nodes, sizeof(int))
+    cdef double *value = <double *>calloc(max_nodes, sizeof(double))
+    cdef signed char *action = <signed char *>calloc(max_nodes, sizeof(signed char))
+    cdef int *parent = <int *>calloc(max_nodes, sizeof(int))
+    cdef int *first_child = <int *>calloc(max_nodes, sizeof(int))
+    cdef signed char *n_children = <signed char *>calloc(
+        max_nodes, sizeof(signed char)
+    )
+    cdef int *next_unvisited = <int *>calloc(max_nodes, sizeof(int))
+    cdef short *xs = <short *>calloc(max_nodes, sizeof(short))
+    cdef short *os = <short *>calloc(max_nodes, sizeof(short))
+    cdef char *xtm = <char *>calloc(max_nodes, sizeof(char))
+
+    cdef int win_code = X_WIN if agent_is_x else O_WIN
+    cdef int n_nodes = 1
+    # random state is local to the call, so searches share nothing
+    cdef unsigned long long rng = seed ^ 0x9E3779B97F4A7C15ULL
+    cdef int i, k, a, node, child, start, stop, best, win, status, x, o
+    cdef bint xt
+    cdef double log_parent, score, best_score, reward
+
+    try:
+        if not (
+            visits and value and action and parent and first_child
+            and n_children and next_unvisited and xs and os and xtm
+        ):
+            raise MemoryError()
+
+        parent[0] = -1
+        xs[0] = x_mask
+        os[0] = o_mask
+        xtm[0] = x_to_move
+
+        with nogil:
+            for i in range(n_iter):
+                # --- selection ---
+                node = 0
+                while n_children[node]:
+                    start = first_child[node]
+                    stop = start + n_children[node]
+                    best = next_unvisited[node]
+                    while best < stop and visits[best]:
+                        best += 1
+                    next_unvisited[node] = best
+                    if best == stop:
+                        log_parent = log(visits[node])
+                        best_score = -INFINITY
+                        for child in range(start, stop):
+                            score = value[child] / visits[child] + c * sqrt(
+                                log_parent / visits[child]
+                            )
+                            if score > best_score:
+                                best = child
+                                best_score = score
+                    node = best
+
+                # --- expansion ---
+                x = xs[node]
+                o = os[node]
+                xt = xtm[node]
+                if check_status(x, o) == -1:
+                    win = winning_action(x, o, xt)
+                    start = n_nodes
+                    for a in range(9):
+                        if (x | o) & (1 << a) or (win != -1 and a != win):
+                            continue
+                        child = n_nodes
+                        n_nodes += 1
+                        if xt:
+                            xs[child] = x | (1 << a)
+                            os[child] = o
+                        else:
+                            xs[child] = x
+                            os[child] = o | (1 << a)
+                        xtm[child] = not xt
+                        action[child] = a
+                        parent[child] = node
+                    first_child[node] = start
+                    next_unvisited[node] = start
+                    n_children[node] = n_nodes - start
+                    node = start + <int>(uniform(&rng) * (n_nodes - start))
+
+                # --- simulation ----
+                reward = 0
+                for k in range(n_rollouts):
+                    status = rollout(xs[node], os[node], xtm[node], &rng)
+                    if status == 0:
+                        reward += 0.5
+                    elif status == win_code:
+                        reward += 1
+
+                # --- backpropogation ---
+                while node != -1:
+                    visits[node] += n_rollouts
+                    value[node] += reward
+                    node = parent[node]
+
+        return {
+            action[child]: visits[child]
+            for child in range(first_child[0], first_child[0] + n_children[0])
+        }
+    finally:
+        free(visits)
+        free(value)
+        free(action)
+        free(parent)
+        free(first_child)
+        free(n_children)
+        free(next_unvisited)
+        free(xs)
+        free(os)
+        free(xtm)
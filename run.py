@@ -7,7 +7,6 @@ https://github.com/haje01/gym-tictactoe/blob/master/examples/base_agent.py
 
 import random
 from collections import Counter
-from copy import copy
 
 from gym_tictactoe.env import TicTacToeEnv, agent_by_mark, next_mark
 from tqdm import tqdm, trange
@@ -49,6 +48,9 @@ def play(num_games, verbose=True):
     else:
         myrange = range
 
+    # init the agents
+    agents = [players["X"]("X"), players["O"]("O")]
+
     for _ in myrange(num_games):
 
         # set up board
@@ -56,8 +58,8 @@ def play(num_games, verbose=True):
         env.set_start_mark(start_mark)
         state = env.reset()
 
-        # init the agents
-        agents = [players["X"]("X"), players["O"]("O")]
+        for agent in agents:
+            agent.reset()
 
         # play until game is done
         while not env.done:
@@ -65,7 +67,7 @@ def play(num_games, verbose=True):
             if verbose:
                 env.show_turn(True, mark)
             agent = agent_by_mark(agents, mark)
-            action = agent.act(state, copy(env))
+            action = agent.act(state)
             state, reward, _, _ = env.step(action)
             if verbose:
                 env.render()
@@ -80,6 +82,9 @@ def play(num_games, verbose=True):
         # rotate start
         start_mark = next_mark(start_mark)
 
+    for agent in agents:
+        agent.close()
+
     # tally and display final stats
     c = Counter(winners)
     total = c[-1] + c[1] + c[0]
@@ -0,0 +1,59 @@
+"""
+Exact solution of tic-tac-toe.
+
+Every reachable position is scored by minimax with memoization,
+and the best move for each is stored in OPTIMAL_MOVE.
+"""
+
+from functools import lru_cache
+
+from board import after_action, available_actions, check_status, pack, unpack
+
+
+@lru_cache(maxsize=None)
+def score(code: int) -> int:
+    """
+    Minimax score of packed state (see board.pack), for the player
+    to move. Positive if they can force a win, negative if they will
+    lose, 0 for a draw. Quicker wins (and slower losses) score higher.
+    """
+    x_mask, o_mask, _ = bstate = unpack(code)
+    gstatus = check_status(x_mask, o_mask)
+    if gstatus == 0:
+        return 0
+    if gstatus != -1:
+        # previous player just won
+        return -(1 + len(available_actions(x_mask, o_mask)))
+    return max(
+        -score(pack(after_action(bstate, action)))
+        for action in available_actions(x_mask, o_mask)
+    )
+
+
+def best_action(bstate) -> int:
+    """Return an optimal move for the player to move"""
+    x_mask, o_mask, _ = bstate
+    return max(
+        available_actions(x_mask, o_mask),
+        key=lambda action: -score(pack(after_action(bstate, action))),
+    )
+
+
+def _build_optimal_moves():
+    """Solve every unfinished position reachable with either mark starting"""
+    table = {}
+    frontier = [(0, 0, "O"), (0, 0, "X")]
+    while frontier:
+        bstate = frontier.pop()
+        x_mask, o_mask, _ = bstate
+        code = pack(bstate)
+        if code in table or check_status(x_mask, o_mask) != -1:
+            continue
+        table[code] = best_action(bstate)
+        for action in available_actions(x_mask, o_mask):
+            frontier.append(after_action(bstate, action))
+    return table
+
+
+# packed state (see board.encode) -> optimal action
+OPTIMAL_MOVE = _build_optimal_moves()